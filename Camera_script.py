@@ -7,12 +7,16 @@ in daily folders.
 """
 
 import cv2
+import numpy as np
 import os
 import time
+import queue
+import signal
+import threading
 from datetime import datetime
-from collections import deque
 from picamera2 import Picamera2
-import RPi.GPIO as GPIO
+from libcamera import Transform
+import pigpio
 
 # ==============================
 # CONFIGURATION SETTINGS
@@ -21,17 +25,22 @@ import RPi.GPIO as GPIO
 # Hardware setup
 TRIG_PIN = 23      # GPIO pin for TRIG sensor
 ECHO_PIN = 24      # GPIO pin for ECHO sensor
-CAMERA_ROTATION = cv2.ROTATE_180  # Camera orientation correction
+CAMERA_TRANSFORM = Transform(hflip=1, vflip=1)  # Camera orientation correction (180 deg, done by the ISP)
+PREVIEW_SIZE = (320, 240)  # Low-resolution stream for preview and UI
+CAPTURE_SIZE = (1280, 960) # Full-resolution stream, only read for saved images
 SAVE_FOLDER = os.path.expanduser("~/Ultrasonic_Motions")  # Main storage directory
 
 # Detection parameters
 DISTANCE_THRESHOLD = 25    # Minimum distance change for detection (cm)
 COOLDOWN_TIME = 7          # Minimum time between detections (seconds)
 MEASUREMENT_WINDOW = 5     # Number of measurements for analysis
+MEASUREMENT_INTERVAL = 0.06  # Pause between pings so old echoes die out (seconds)
 STABILIZATION_SAMPLES = 10 # Initial measurements for calibration
+SCENE_HASH_TOLERANCE = 4   # Max differing scene hash bits to skip a save as "same scene"
 
 # Interface settings
-UI_SCALE = 1.0            # UI elements scale
+HEADLESS = not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))  # No display: skip UI and preview
+UI_SCALE = PREVIEW_SIZE[0] / 640  # UI elements scale (layout designed for 640 px width)
 FONT = cv2.FONT_HERSHEY_SIMPLEX  # Font type
 COLORS = {
     'background': (40, 40, 40),   # Dark gray background
@@ -39,25 +48,89 @@ COLORS = {
     'alert': (0, 0, 255),         # Red alert (BGR format)
     'status': (100, 100, 100)     # Gray status bar
 }
+HEADER_HEIGHT = int(40*UI_SCALE)  # Header bar height (pixels)
+STATUS_HEIGHT = int(40*UI_SCALE)  # Status bar height (pixels)
+
+# Sensor state (filled in by pigpio edge callbacks)
+pi = None                        # Connection to the pigpiod daemon
+trigger_wave = None              # DMA waveform with the 10 us TRIG pulse
+echo_rise_tick = None            # Tick (us) of the last ECHO rising edge
+echo_fall_tick = None            # Tick (us) of the last ECHO falling edge
+echo_received = threading.Event()
+latest_distance = None           # Newest valid reading from the sampler thread
+
+# Sliding window of valid readings (NumPy ring buffer guarded by measurements_lock).
+# Slot order does not matter for aggregates, so measurements[:measurements_count]
+# can be passed straight to np.mean/np.std/np.ptp.
+measurements = np.zeros(MEASUREMENT_WINDOW, dtype=np.float64)
+measurements_head = 0            # Slot to be overwritten by the next reading
+measurements_count = 0           # Number of filled slots
+latest_change = None             # Newest vs. oldest reading over a full window
+measurements_lock = threading.Lock()
+
+# Pre-rendered static UI strips, keyed by frame width
+ui_overlays = {}
+status_text_values = None        # (distance, last_capture) of the cached status text
+status_text = None
 
 # ==============================
 # HELPER FUNCTIONS
 # ==============================
 
+def _on_echo_rise(gpio, level, tick):
+    """Stores the daemon timestamp of the echo pulse start."""
+    global echo_rise_tick
+    echo_rise_tick = tick
+
+def _on_echo_fall(gpio, level, tick):
+    """Stores the daemon timestamp of the echo pulse end and wakes the reader."""
+    global echo_fall_tick
+    echo_fall_tick = tick
+    echo_received.set()
+
 def setup_gpio():
-    """Initializes GPIO pins for ultrasonic sensor."""
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(TRIG_PIN, GPIO.OUT)
-    GPIO.setup(ECHO_PIN, GPIO.IN)
-    GPIO.output(TRIG_PIN, False)
+    """Connects to pigpiod and prepares GPIO pins for ultrasonic sensor."""
+    global pi, trigger_wave
+    pi = pigpio.pi()
+    if not pi.connected:
+        raise RuntimeError("Cannot connect to pigpio daemon (is pigpiod running?)")
+    pi.set_mode(TRIG_PIN, pigpio.OUTPUT)
+    pi.set_mode(ECHO_PIN, pigpio.INPUT)
+    pi.write(TRIG_PIN, 0)
+
+    # Precise 10 us trigger pulse, timed by DMA instead of a CPU sleep
+    pi.wave_clear()
+    pi.wave_add_generic([
+        pigpio.pulse(1 << TRIG_PIN, 0, 10),
+        pigpio.pulse(0, 1 << TRIG_PIN, 0)
+    ])
+    trigger_wave = pi.wave_create()
+
+    # Edges are timestamped by the daemon, no polling needed
+    pi.callback(ECHO_PIN, pigpio.RISING_EDGE, _on_echo_rise)
+    pi.callback(ECHO_PIN, pigpio.FALLING_EDGE, _on_echo_fall)
     time.sleep(1)
 
+def cleanup_gpio():
+    """Releases the trigger waveform and disconnects from pigpiod."""
+    if pi is None:
+        return
+    if trigger_wave is not None:
+        pi.wave_delete(trigger_wave)
+    pi.write(TRIG_PIN, 0)
+    pi.stop()
+
 def initialize_camera():
     """Starts Raspberry Pi camera and returns camera object."""
     try:
         camera = Picamera2()
-        config = camera.create_preview_configuration(
-            main={"size": (640, 480), "format": "RGB888"})
+        # libcamera "RGB888" is stored as [B, G, R], which is what OpenCV expects.
+        # The lores stream feeds the preview, main is only read on detection.
+        config = camera.create_video_configuration(
+            main={"size": CAPTURE_SIZE, "format": "RGB888"},
+            lores={"size": PREVIEW_SIZE, "format": "YUV420"},
+            display="lores",
+            transform=CAMERA_TRANSFORM)
         camera.configure(config)
         camera.start()
         time.sleep(2)  # Allow camera initialization
@@ -73,36 +146,82 @@ def measure_distance():
         float: Distance in centimeters (2-400 cm)
         None: For invalid measurements
     """
+    global echo_rise_tick
     try:
-        # Generate ultrasonic pulse
-        GPIO.output(TRIG_PIN, True)
-        time.sleep(0.00001)
-        GPIO.output(TRIG_PIN, False)
-
-        # Measure echo return time
-        start_time = time.time()
-        timeout = start_time + 0.04  # Maximum measurement duration
-
-        # Wait for echo pulse start
-        while GPIO.input(ECHO_PIN) == 0:
-            start_time = time.time()
-            if start_time > timeout:
-                return None
-
-        # Measure echo pulse end
-        end_time = time.time()
-        while GPIO.input(ECHO_PIN) == 1:
-            end_time = time.time()
-            if end_time > timeout:
-                return None
-
-        # Calculate distance
-        distance = (end_time - start_time) * 17150
+        # Forget edges from any previous measurement
+        echo_rise_tick = None
+        echo_received.clear()
+
+        # Generate 10 us ultrasonic pulse
+        pi.wave_send_once(trigger_wave)
+
+        # Wait for echo pulse end (maximum measurement duration 40 ms)
+        if not echo_received.wait(0.04) or echo_rise_tick is None:
+            return None
+
+        # Calculate distance from daemon ticks (microseconds)
+        distance = pigpio.tickDiff(echo_rise_tick, echo_fall_tick) * 0.01715
         return round(distance, 1) if 2 < distance < 400 else None
     except Exception as error:
         print(f"Measurement error: {error}")
         return None
 
+def record_measurement(distance):
+    """Pushes a valid reading into the window and updates the change in O(1)."""
+    global measurements_head, measurements_count, latest_distance, latest_change
+    with measurements_lock:
+        measurements[measurements_head] = distance
+        measurements_head = (measurements_head + 1) % MEASUREMENT_WINDOW
+        measurements_count = min(measurements_count + 1, MEASUREMENT_WINDOW)
+        latest_distance = distance
+
+        # The next slot to overwrite holds the oldest reading of the window
+        if measurements_count == MEASUREMENT_WINDOW:
+            latest_change = abs(distance - float(measurements[measurements_head]))
+        else:
+            latest_change = None
+
+def clear_measurements():
+    """Empties the window so detection waits for a fresh set of readings."""
+    global measurements_head, measurements_count, latest_change
+    with measurements_lock:
+        measurements_head = 0
+        measurements_count = 0
+        latest_change = None
+
+def scene_hash(frame):
+    """
+    Computes a 64-bit average hash of the frame.
+    The frame is reduced to 8x8 grayscale and each pixel is compared to the mean,
+    so small changes in light or noise do not change the hash much.
+    """
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (8, 8),
+                       interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small > small.mean()).tobytes(), 'big')
+
+def get_ui_overlays(width):
+    """
+    Returns static header and status bar strips for the given frame width.
+    They are rendered on first use and then only copied into each frame.
+    """
+    overlays = ui_overlays.get(width)
+    if overlays is None:
+        header = np.full((HEADER_HEIGHT, width, 3), COLORS['background'], dtype=np.uint8)
+        cv2.putText(header, "Ultrasonic Security System", (int(10*UI_SCALE), int(30*UI_SCALE)), 
+                   FONT, 0.8*UI_SCALE, COLORS['text'], 1)
+        status_bar = np.full((STATUS_HEIGHT, width, 3), COLORS['status'], dtype=np.uint8)
+        overlays = ui_overlays[width] = (header, status_bar)
+    return overlays
+
+def get_status_text(distance, last_capture):
+    """Returns the status bar text, rebuilt only when its values change."""
+    global status_text_values, status_text
+    if (distance, last_capture) != status_text_values:
+        status_text_values = (distance, last_capture)
+        status_text = (f"Current: {distance}cm | Last detection: {last_capture} | "
+                       "Press 'q' to quit") if distance else "Initializing..."
+    return status_text
+
 def create_interface(frame, distance, last_capture):
     """
     Renders user interface onto the frame.
@@ -117,27 +236,73 @@ def create_interface(frame, distance, last_capture):
         return None
         
     try:
+        header, status_bar = get_ui_overlays(frame.shape[1])
+
         # Header
-        cv2.rectangle(frame, (0, 0), (frame.shape[1], 40), COLORS['background'], -1)
-        cv2.putText(frame, "Ultrasonic Security System", (10, 30), 
-                   FONT, 0.8*UI_SCALE, COLORS['text'], 1)
+        frame[:HEADER_HEIGHT] = header
 
         # Status bar
-        status_text = (f"Current: {distance}cm | Last detection: {last_capture} | "
-                       "Press 'q' to quit") if distance else "Initializing..."
-        cv2.rectangle(frame, (0, frame.shape[0]-40), (frame.shape[1], frame.shape[0]), 
-                      COLORS['status'], -1)
-        cv2.putText(frame, status_text, (10, frame.shape[0]-10), 
+        frame[-STATUS_HEIGHT:] = status_bar
+        cv2.putText(frame, get_status_text(distance, last_capture), (int(10*UI_SCALE), frame.shape[0]-int(10*UI_SCALE)), 
                    FONT, 0.6*UI_SCALE, COLORS['text'], 1)
 
         # Timestamp
         cv2.putText(frame, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 
-                   (10, frame.shape[0]-60), FONT, 0.5*UI_SCALE, COLORS['text'], 1)
+                   (int(10*UI_SCALE), frame.shape[0]-int(60*UI_SCALE)), FONT, 0.5*UI_SCALE, COLORS['text'], 1)
         return frame
     except Exception as error:
         print(f"UI rendering error: {error}")
         return None
 
+def grab_frames(camera, frame_queue, stop_event):
+    """
+    Continuously captures low-resolution preview frames for the main loop.
+    Only the newest frame is kept in the queue, older ones are dropped.
+    """
+    while not stop_event.is_set():
+        try:
+            frame = camera.capture_array("lores")
+            if frame is None:
+                raise RuntimeError("Received empty frame")
+
+            # The lores stream is planar YUV420, the UI is drawn in BGR
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV420p2BGR)
+        except Exception as error:
+            print(f"Frame capture error: {error}")
+            time.sleep(1)
+            continue
+
+        # Drop the stale frame (this thread is the only producer)
+        try:
+            frame_queue.get_nowait()
+        except queue.Empty:
+            pass
+        frame_queue.put(frame)
+
+def sample_distances(stop_event):
+    """Measures distance back-to-back and records valid readings in the window."""
+    while not stop_event.is_set():
+        distance = measure_distance()
+        if distance is not None:
+            record_measurement(distance)
+        time.sleep(MEASUREMENT_INTERVAL)
+
+def write_images(save_queue):
+    """
+    Encodes frames queued by the main loop and writes them to disk.
+    Runs until a None item is received.
+    """
+    while True:
+        item = save_queue.get()
+        if item is None:
+            break
+        full_path, image = item
+        try:
+            if not cv2.imwrite(full_path, image):
+                raise RuntimeError("JPEG encoding failed")
+        except Exception as error:
+            print(f"Save error: {error}")
+
 # ==============================
 # MAIN PROGRAM LOOP
 # ==============================
@@ -167,8 +332,14 @@ def main():
         return
 
     # Initialize variables
-    measurements = deque(maxlen=MEASUREMENT_WINDOW)
+    frame_queue = queue.Queue(maxsize=1)
+    save_queue = queue.Queue()
+    stop_event = threading.Event()
     last_capture_time = 0
+    last_capture_text = "None"  # Formatted only when last_capture_time changes
+    last_image_hash = None
+    current_day = None          # Date of the last created daily directory
+    daily_path = None
     stabilization_count = 0
 
     # Calibration phase
@@ -177,78 +348,91 @@ def main():
             stabilization_count += 1
         time.sleep(0.1)
 
+    # Background workers: camera producer, ultrasonic sampler and image writer
+    workers = [
+        threading.Thread(target=grab_frames, args=(camera, frame_queue, stop_event), daemon=True),
+        threading.Thread(target=sample_distances, args=(stop_event,), daemon=True),
+        threading.Thread(target=write_images, args=(save_queue,), daemon=True)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Stop cleanly on Ctrl+C or service stop (the only way to quit when headless)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stop_event.set())
+
     try:
-        while True:
-            current_distance = measure_distance()
-            current_time = time.time()
-            
-            # Capture camera frame
+        # Display window setup (done once, not per frame)
+        if not HEADLESS:
+            cv2.namedWindow("Monitor", cv2.WND_PROP_FULLSCREEN)
+            cv2.setWindowProperty("Monitor", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+
+        while not stop_event.is_set():
+            # Wait for the newest camera frame
             try:
-                frame = camera.capture_array()
-                if frame is None:
-                    raise RuntimeError("Received empty frame")
-                
-                # Adjust frame orientation
-                frame = cv2.rotate(frame, CAMERA_ROTATION)
-                
-                if frame is None:
-                    raise RuntimeError("Frame processing error")
-            except Exception as error:
-                print(f"Frame capture error: {error}")
-                time.sleep(1)
+                frame = frame_queue.get(timeout=1)
+            except queue.Empty:
+                print("Frame capture error: no frame received")
                 continue
+            current_time = time.time()
+
+            # Snapshot sensor state
+            with measurements_lock:
+                current_distance = latest_distance
+                avg_change = latest_change
 
             processed_frame = None
             if current_distance is not None:
-                measurements.append(current_distance)
-                
-                # Create UI copy
-                try:
-                    frame_copy = frame.copy()
-                except AttributeError as error:
-                    print(f"Frame copy error: {error}")
-                    continue
-                
-                # Render interface
-                processed_frame = create_interface(
-                    frame_copy,
-                    current_distance,
-                    datetime.fromtimestamp(last_capture_time).strftime("%H:%M:%S") if last_capture_time else "None"
-                )
-
                 # Motion detection
-                if len(measurements) >= MEASUREMENT_WINDOW and (current_time - last_capture_time) > COOLDOWN_TIME:
-                    avg_change = abs(measurements[-1] - measurements[0])
-                    
+                if avg_change is not None and (current_time - last_capture_time) > COOLDOWN_TIME:
                     if avg_change > DISTANCE_THRESHOLD:
                         try:
-                            # Get current timestamp once
-                            now = datetime.now()
-                            
-                            # Create daily directory
-                            date_folder = now.strftime("%Y-%m-%d")
-                            daily_path = os.path.join(SAVE_FOLDER, date_folder)
-                            os.makedirs(daily_path, exist_ok=True)
-                            
-                            # Generate filename
-                            filename = f"ultrasonic_{now.strftime('%Y%m%d_%H%M%S')}.jpg"
-                            full_path = os.path.join(daily_path, filename)
-                            
-                            # Save image
-                            cv2.imwrite(full_path, frame)
-                            print(f"Alert! Detected {avg_change}cm change. Image saved at {full_path}")
-                            
+                            # Skip saving when the scene matches the last saved image
+                            image_hash = scene_hash(frame)
+                            if (last_image_hash is not None and
+                                    bin(image_hash ^ last_image_hash).count('1') <= SCENE_HASH_TOLERANCE):
+                                print(f"Detected {avg_change}cm change, but the scene is unchanged. Image not saved")
+                            else:
+                                # Get current timestamp once
+                                now = datetime.now()
+                                
+                                # Create daily directory (only when the day changes)
+                                date_folder = now.strftime("%Y-%m-%d")
+                                if date_folder != current_day:
+                                    daily_path = os.path.join(SAVE_FOLDER, date_folder)
+                                    os.makedirs(daily_path, exist_ok=True)
+                                    current_day = date_folder
+                                
+                                # Generate filename
+                                filename = f"ultrasonic_{now.strftime('%Y%m%d_%H%M%S')}.jpg"
+                                full_path = os.path.join(daily_path, filename)
+                                
+                                # Grab full-resolution image, the writer thread encodes and stores it
+                                save_queue.put((full_path, camera.capture_array("main")))
+                                print(f"Alert! Detected {avg_change}cm change. Saving image to {full_path}")
+                                last_image_hash = image_hash
+
                             # Update last capture time and clear measurements
                             last_capture_time = current_time
-                            measurements.clear()
+                            last_capture_text = datetime.fromtimestamp(last_capture_time).strftime("%H:%M:%S")
+                            clear_measurements()
                         except Exception as error:
                             print(f"Save error: {error}")
 
+                # Render interface directly onto the preview frame
+                if not HEADLESS:
+                    processed_frame = create_interface(
+                        frame,
+                        current_distance,
+                        last_capture_text
+                    )
+
+            if HEADLESS:
+                continue
+
             # Display window
             try:
                 if processed_frame is not None:
-                    cv2.namedWindow("Monitor", cv2.WND_PROP_FULLSCREEN)
-                    cv2.setWindowProperty("Monitor", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
                     cv2.imshow("Monitor", processed_frame)
             except Exception as error:
                 print(f"Display error: {error}")
@@ -257,13 +441,16 @@ def main():
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
-            time.sleep(0.1)
-
     finally:
+        stop_event.set()
+        save_queue.put(None)  # Let the writer finish pending images
+        for worker in workers:
+            worker.join(timeout=2)
         if camera is not None:
             camera.stop()
-        GPIO.cleanup()
-        cv2.destroyAllWindows()
+        cleanup_gpio()
+        if not HEADLESS:
+            cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
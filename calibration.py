@@ -1,16 +1,31 @@
 import json  
+import time  
+import numpy as np  
+import Camera_script as sensor  
 
-def calibrate_sensor(samples=100):  
-    """Kalibruje senzor na základě průměru N měření."""  
-    baseline = 0  
+def valid_readings(samples):  
+    """Vrací platná měření z N pokusů (neplatná měření se vynechají)."""  
     for _ in range(samples):  
-        baseline += measure_distance()  
-    return baseline / samples  
+        distance = sensor.measure_distance()  
+        if distance is not None:  
+            yield distance  
+        time.sleep(sensor.MEASUREMENT_INTERVAL)  
+
+def calibrate_sensor(samples=100):  
+    """Kalibruje senzor na základě mediánu N měření (odolný vůči falešným odrazům)."""  
+    values = np.fromiter(valid_readings(samples), dtype=np.float64)  
+    if values.size == 0:  
+        raise RuntimeError("Senzor nevrátil žádné platné měření")  
+    return {"baseline": float(np.median(values)), "std": float(np.std(values))}  
 
 def save_calibration(data, filename="calibration.json"):  
     with open(filename, 'w') as f:  
         json.dump(data, f)  
 
 if __name__ == "__main__":  
-    calibration_data = {"baseline": calibrate_sensor()}  
+    sensor.setup_gpio()  
+    try:  
+        calibration_data = calibrate_sensor()  
+    finally:  
+        sensor.cleanup_gpio()  
     save_calibration(calibration_data)  